@@ -1,15 +1,23 @@
 import asyncio
+from contextlib import contextmanager
 import functools
 from pathlib import Path
-from typing import Any, Awaitable, Callable, List, Union
+from typing import Any, Awaitable, Callable, Iterator, List, Optional, Union
 
 import click
 import click_log
 
 from de.config import Config, PROJECT_ROOT, SCRIPTS_DIR, SRC_ROOT, TESTS_DIR
-from de.discord import DiscordBot, EDIT, REPLACE
+from de.discord import Baseline, Changeset, DiscordBot, EDIT, EmojiUpdate, REPLACE
+from de.emojis import EmojiError, load_emojis
+from de.estimate import estimate_changeset
+from de.git import changed_emoji_names, GitError
 from de.logger import logger
+from de.mirror import DOWNLOAD_CONCURRENCY, export_custom_emojis, open_mirror
+from de.plan import Plan, PlanError, read_plan, write_plan
+from de.pool import TokenPoolError
 from de.steps import fmt_step, Step, StepError, steps as _steps
+from de.trace import tracing
 
 click_log.basic_config(logger)
 
@@ -27,6 +35,9 @@ def capture(fn: CLIHandler) -> CLIHandler:
             logger.error(f"Step {fmt_step(exc.step)} failed!")
             logger.debug(exc.env)
             raise click.Abort()
+        except (EmojiError, GitError, PlanError, TokenPoolError) as exc:
+            logger.error(str(exc))
+            raise click.Abort()
         except Exception:
             logger.exception("FLAGRANT SYSTEM ERROR")
             raise click.Abort()
@@ -71,11 +82,26 @@ qa = run_steps("qa", [PYTHON_LINT_STEP, SHELL_LINT_STEP, TEST_STEP])
 def async_command(fn: AsyncCLIHandler) -> CLIHandler:
     @cli.command()
     @click_log.simple_verbosity_option(logger)
+    @click.option(
+        "--trace",
+        type=click.Path(dir_okay=False, writable=True),
+        default=None,
+        help="Write a Chrome trace of the run to this file.",
+    )
+    @click.option(
+        "--profile",
+        type=click.Path(dir_okay=False, writable=True),
+        default=None,
+        help="Write cProfile stats for the CPU-bound stages to this file.",
+    )
     @click.pass_obj
     @functools.wraps(fn)
-    def command(*args, **kwargs):
+    def command(*args, trace, profile, **kwargs):
         loop = asyncio.get_event_loop()
-        loop.run_until_complete(capture(fn)(*args, **kwargs))
+        with tracing(trace, profile):
+            # The coroutine's errors only come out of run_until_complete, so that's
+            # what needs capturing.
+            capture(loop.run_until_complete)(fn(*args, **kwargs))
 
     return command
 
@@ -92,20 +118,58 @@ class UpdateActionParam(click.ParamType):
 
 UPDATE_ACTION = UpdateActionParam()
 
+BASELINE = click.Path(exists=True)
+
+
+@contextmanager
+def baseline_mirror(path: Optional[str]) -> Iterator[Optional[Baseline]]:
+    if path is None:
+        yield None
+        return
+    with open_mirror(path) as mirror:
+        logger.info(f"Comparing against {len(mirror)} mirrored emojis in {path}...")
+        yield mirror.image
+
 
 @async_command
 @click.option("--yarly", is_flag=True, default=False)
 @click.option("--dry-run", is_flag=True, default=False)
 @click.option("--update-action", type=UPDATE_ACTION, default=EDIT)
-async def sync_emojis(config, yarly, dry_run, update_action):
+@click.option("--baseline", type=BASELINE, default=None)
+@click.option("--since", default=None, help="Only sync emojis changed since this rev.")
+async def sync_emojis(config, yarly, dry_run, update_action, baseline, since):
+    scope = None
+
+    if since is not None:
+        scope = changed_emoji_names(since)
+        if not scope:
+            logger.info(f"No emojis have changed since {since}, so nothing to do!")
+            return
+        logger.info(
+            f"Only syncing emojis changed since {since}: {', '.join(sorted(scope))}"
+        )
+
     bot = DiscordBot(config)
 
     async with bot.connection():
-        changeset = await bot.get_custom_emoji_changeset()
+        with baseline_mirror(baseline) as lookup:
+            changeset = await bot.get_custom_emoji_changeset(
+                baseline=lookup, scope=scope
+            )
 
         click.echo(changeset.report(update_action=update_action))
 
         if dry_run:
+            estimate = estimate_changeset(
+                changeset,
+                update_action=update_action,
+                emoji_limit=bot.get_emoji_limit(),
+                concurrency=config.EMOJI_CONCURRENCY,
+                tokens=1 + len(config.extra_api_tokens),
+            )
+            click.echo(estimate.report())
+            if estimate.exceeds_emoji_limit:
+                logger.warning("This changeset would run out of emoji slots!")
             logger.info("Exiting after a dry run...")
         elif yarly or click.confirm("Do you want to apply these changes?"):
             await bot.apply_custom_emoji_changeset(
@@ -115,5 +179,85 @@ async def sync_emojis(config, yarly, dry_run, update_action):
             logger.warning("Not doing!")
 
 
+@async_command
+@click.option(
+    "-o", "--output", type=click.Path(dir_okay=False, writable=True), required=True
+)
+@click.option("--update-action", type=UPDATE_ACTION, default=EDIT)
+@click.option("--baseline", type=BASELINE, default=None)
+async def plan(config, output, update_action, baseline):
+    bot = DiscordBot(config)
+
+    async with bot.connection():
+        with baseline_mirror(baseline) as lookup:
+            changeset = await bot.get_custom_emoji_changeset(baseline=lookup)
+
+    click.echo(changeset.report(update_action=update_action))
+
+    write_plan(
+        output,
+        Plan(
+            guild_id=config.BOT_GUILD_ID,
+            update_action=update_action,
+            changeset=changeset,
+        ),
+    )
+
+
+@async_command
+@click.argument("plan_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--yarly", is_flag=True, default=False)
+async def apply(config, plan_file, yarly):
+    plan = read_plan(plan_file)
+    bot = DiscordBot(config)
+
+    async with bot.connection():
+        upstream = await bot.get_all_custom_emojis()
+        plan.check_drift(config.BOT_GUILD_ID, upstream)
+
+        click.echo(plan.changeset.report(update_action=plan.update_action))
+
+        if yarly or click.confirm("Do you want to apply this plan?"):
+            await bot.apply_custom_emoji_changeset(
+                plan.changeset, update_action=plan.update_action
+            )
+        else:
+            logger.warning("Not doing!")
+
+
+@async_command
+@click.argument("destination", type=click.Path())
+@click.option("--concurrency", type=int, default=DOWNLOAD_CONCURRENCY)
+async def export_emojis(config, destination, concurrency):
+    bot = DiscordBot(config)
+
+    async with bot.connection():
+        with open_mirror(destination, writable=True) as mirror:
+            downloaded, skipped = await export_custom_emojis(
+                bot, mirror, concurrency=concurrency
+            )
+
+    logger.info(f"Downloaded {downloaded} emojis and skipped {skipped}.")
+
+
+@async_command
+async def watch_emojis(config):
+    bot = DiscordBot(config, live=True)
+
+    live = bot.live
+    assert live is not None
+
+    def on_update(update: EmojiUpdate):
+        local = load_emojis(max_pixels=config.EMOJI_MAX_PIXELS)
+        changeset = Changeset.diff(live.emojis, local)
+        click.echo(changeset.report())
+
+    live.listeners.append(on_update)
+
+    async with bot.connection():
+        logger.info("Watching for emoji changes...")
+        await asyncio.Event().wait()
+
+
 if __name__ == "__main__":
     cli()
@@ -7,6 +7,7 @@ from typing import (
     Dict,
     get_args,
     get_origin,
+    List,
     MutableMapping,
     Optional,
     Type,
@@ -60,7 +61,12 @@ class EnvVarLoadError(ConfigError):
 
 
 DiscordAPIToken = Optional[str]
+DiscordAPITokenPool = Optional[str]
 DiscordGuildID = int
+Concurrency = int
+PixelCount = int
+
+DEFAULT_EMOJI_MAX_PIXELS: PixelCount = 25_000_000
 
 
 def _load_env_var(field: Field) -> Any:
@@ -88,7 +94,25 @@ def _load_env_var(field: Field) -> Any:
 class Config:
     DISCORD_API_TOKEN: DiscordAPIToken
     step_env: Environment
+    DISCORD_API_TOKEN_POOL: DiscordAPITokenPool = None
     BOT_GUILD_ID: DiscordGuildID = 566333122615181327
+    EMOJI_CONCURRENCY: Concurrency = 1
+    EMOJI_MAX_PIXELS: PixelCount = DEFAULT_EMOJI_MAX_PIXELS
+
+    @property
+    def extra_api_tokens(self) -> List[str]:
+        """
+        Additional bot tokens, comma separated in `DISCORD_API_TOKEN_POOL`, whose
+        rate limit budgets emoji writes can be spread across.
+        """
+
+        if not self.DISCORD_API_TOKEN_POOL:
+            return []
+        return [
+            token.strip()
+            for token in self.DISCORD_API_TOKEN_POOL.split(",")
+            if token.strip()
+        ]
 
     @classmethod
     def load(cls):
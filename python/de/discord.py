@@ -1,14 +1,32 @@
 import asyncio
+from collections import Counter
 from contextlib import asynccontextmanager
-from dataclasses import dataclass
-from typing import Any, Awaitable, Dict, List, Optional, Set, Tuple, Union
+from dataclasses import dataclass, field
+import functools
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Counter as CounterT,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import discord
+from discord.http import HTTPClient
 import pandas as pd
+from PIL import Image
 
-from de.config import Config
-from de.emojis import Emoji, EmojiMapping, image_base64, load_emojis
+from de.config import Config, DiscordGuildID
+from de.emojis import Emoji, EmojiMapping, EmojiName, load_emojis, same_pixels
 from de.logger import logger
+from de.pool import current_http, TokenPool
+from de.tasks import gather_or_cancel
+from de.trace import traced, tracer
 
 DiscordID = str
 
@@ -25,6 +43,8 @@ JSObject = Dict[
 ]
 JSON = Union[JSValue, JSArray, JSObject]
 
+CDN_URL = "https://cdn.discordapp.com"
+
 
 @dataclass
 class EmojiResource:
@@ -36,6 +56,14 @@ class EmojiResource:
     managed: bool
     animated: bool
 
+    @property
+    def extension(self) -> str:
+        return "gif" if self.animated else "png"
+
+    @property
+    def url(self) -> str:
+        return f"{CDN_URL}/emojis/{self.id}.{self.extension}"
+
     @classmethod
     def from_payload(cls, payload: JSON):
         if not isinstance(payload, dict):
@@ -145,14 +173,33 @@ EDIT = UpdateAction("edit")
 REPLACE = UpdateAction("replace")
 
 
+Baseline = Callable[[EmojiResource], Optional[Image]]
+
+
 @dataclass
 class Changeset:
     update: List[Tuple[str, EmojiResource, Emoji]]
     remove: List[Tuple[str, EmojiResource]]
     create: List[Tuple[str, Emoji]]
+    upstream: List[EmojiResource] = field(default_factory=list)
+    unchanged: List[Tuple[str, EmojiResource, Emoji]] = field(default_factory=list)
 
     @classmethod
-    def diff(cls, upstream: List[EmojiResource], local: EmojiMapping) -> "Changeset":
+    @traced("Changeset.diff", cpu=True)
+    def diff(
+        cls,
+        upstream: List[EmojiResource],
+        local: EmojiMapping,
+        baseline: Optional[Baseline] = None,
+        scope: Optional[Set[EmojiName]] = None,
+    ) -> "Changeset":
+        """
+        Work out what needs to change to get from the upstream emojis to the local
+        ones. If a baseline is given, emojis whose upstream pixels match the local
+        image are left out of the update list. If a scope is given, only emojis
+        with those names are considered at all.
+        """
+
         upstream_lookup: Dict[str, EmojiResource] = dict()
         upstream_keys: Set[str] = set()
         managed_keys: Set[str] = set()
@@ -166,15 +213,29 @@ class Changeset:
             else:
                 upstream_keys.add(up.name)
 
+        if scope is not None:
+            upstream_keys &= scope
+            local_keys &= scope
+
+        update: List[Tuple[str, EmojiResource, Emoji]] = []
+        unchanged: List[Tuple[str, EmojiResource, Emoji]] = []
+
+        for key in upstream_keys & local_keys:
+            entry = (key, upstream_lookup[key], local[key])
+            previous = baseline(upstream_lookup[key]) if baseline else None
+            if previous is not None and same_pixels(local[key].image(), previous):
+                unchanged.append(entry)
+            else:
+                update.append(entry)
+
         return cls(
-            update=[
-                (key, upstream_lookup[key], local[key])
-                for key in upstream_keys & local_keys
-            ],
+            update=update,
             remove=[(key, upstream_lookup[key]) for key in upstream_keys - local_keys],
             create=[
                 (key, local[key]) for key in local_keys - upstream_keys - managed_keys
             ],
+            upstream=list(upstream),
+            unchanged=unchanged,
         )
 
     def report(self, update_action: UpdateAction = EDIT) -> pd.DataFrame:
@@ -186,30 +247,196 @@ class Changeset:
             table.append(report_row(name, "remove", resource=r))
         for name, e in self.create:
             table.append(report_row(name, "create", emoji=e))
+        for name, r, e in self.unchanged:
+            table.append(report_row(name, "unchanged", resource=r, emoji=e))
 
         df = pd.DataFrame(data=table, columns=REPORT_COLS)
 
         return df
 
 
+GUILD_CREATE = "GUILD_CREATE"
+GUILD_EMOJIS_UPDATE = "GUILD_EMOJIS_UPDATE"
+
+
+@dataclass
+class EmojiUpdate:
+    added: List[EmojiResource] = field(default_factory=list)
+    removed: List[EmojiResource] = field(default_factory=list)
+    changed: List[EmojiResource] = field(default_factory=list)
+    out_of_band: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+
+Listener = Callable[[EmojiUpdate], Any]
+
+
+class LiveEmojis:
+    """
+    An in-memory copy of the guild's custom emojis, kept current from gateway
+    events instead of REST listings. It's seeded by the GUILD_CREATE event the
+    gateway sends on connect and replaced wholesale on every
+    GUILD_EMOJIS_UPDATE, which always carries the guild's full emoji list. The
+    GUILD_CREATE sent after a reconnect is diffed like any other update, so
+    changes made while we were disconnected still get reported.
+
+    Changes to emojis we didn't say we were about to touch (see `expect`) are
+    reported as out-of-band, which usually means somebody edited them in the
+    Discord UI.
+    """
+
+    def __init__(self, guild_id: DiscordGuildID):
+        self.guild_id = guild_id
+        self.listeners: List[Listener] = []
+        self._emojis: Optional[Dict[DiscordID, EmojiResource]] = None
+        self._expected: CounterT[str] = Counter()
+
+    @property
+    def ready(self) -> bool:
+        return self._emojis is not None
+
+    @property
+    def emojis(self) -> List[EmojiResource]:
+        if self._emojis is None:
+            raise RuntimeError("Haven't received the guild's emojis yet!")
+        return list(self._emojis.values())
+
+    def expect(self, key: str):
+        """
+        Note that this process is about to create, edit or delete the emoji with
+        this name or ID, so that the resulting event isn't reported as out-of-band.
+        """
+
+        self._expected[key] += 1
+
+    def _consume(self, resource: EmojiResource) -> bool:
+        for key in [resource.id, resource.name]:
+            if self._expected[key]:
+                self._expected[key] -= 1
+                return True
+        return False
+
+    def handle(self, msg: JSON) -> Optional[EmojiUpdate]:
+        if not isinstance(msg, dict) or not isinstance(msg.get("d"), dict):
+            return None
+
+        event = msg.get("t")
+        data: Dict[str, Any] = msg["d"]  # type: ignore
+
+        if event == GUILD_CREATE:
+            guild_id = data.get("id")
+        elif event == GUILD_EMOJIS_UPDATE:
+            guild_id = data.get("guild_id")
+        else:
+            return None
+
+        if guild_id is None or int(guild_id) != self.guild_id:
+            return None
+
+        emojis = {
+            resource.id: resource
+            for resource in (
+                EmojiResource.from_payload(raw) for raw in data.get("emojis", [])
+            )
+        }
+
+        if self._emojis is None:
+            logger.debug(f"Seeded {len(emojis)} emojis from {event}")
+            self._emojis = emojis
+            return None
+
+        update = self._update(emojis)
+
+        for listener in self.listeners:
+            listener(update)
+
+        return update
+
+    def _update(self, emojis: Dict[DiscordID, EmojiResource]) -> EmojiUpdate:
+        assert self._emojis is not None
+
+        previous = self._emojis
+        update = EmojiUpdate(
+            added=[r for id_, r in emojis.items() if id_ not in previous],
+            removed=[r for id_, r in previous.items() if id_ not in emojis],
+            changed=[
+                r for id_, r in emojis.items() if id_ in previous and previous[id_] != r
+            ],
+        )
+        self._emojis = emojis
+
+        for resource in update.added + update.removed + update.changed:
+            if not self._consume(resource) and resource.name not in update.out_of_band:
+                update.out_of_band.append(resource.name)
+
+        if update.out_of_band:
+            logger.warning(
+                f"Emojis changed outside of this process: "
+                f"{', '.join(update.out_of_band)}"
+            )
+
+        return update
+
+
 Seconds = float
 
 
 class DiscordBot:
     CLOSE_TIMEOUT: Seconds = 5.0
 
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, live: bool = False):
         self.config = config
         self.client: discord.Client = discord.Client()
+        self.live: Optional[LiveEmojis] = None
+        self.pool: Optional[TokenPool] = None
+
+        if live:
+            self.live = LiveEmojis(config.BOT_GUILD_ID)
+            setattr(self.client, "on_socket_response", self.on_socket_response)
+
+    async def on_socket_response(self, msg: JSON):
+        if self.live is not None:
+            self.live.handle(msg)
+
+    def expect(self, key: str):
+        if self.live is not None:
+            self.live.expect(key)
 
     async def start(self):
         logger.info("Starting the Discord bot...")
         await self.client.start(self.config.DISCORD_API_TOKEN)
 
     async def close(self):
+        if self.pool is not None:
+            logger.info("Closing the token pool...")
+            await self.pool.close()
+            self.pool = None
         logger.info("Closing the Discord bot websocket connection...")
         await self.client.close()
 
+    async def open_pool(self):
+        tokens = self.config.extra_api_tokens
+        if not tokens:
+            return
+
+        logger.info(f"Logging in {len(tokens)} extra bot tokens...")
+        pool = TokenPool(concurrency=self.config.EMOJI_CONCURRENCY)
+        pool.add(self.client.http, label="0")
+        self.pool = pool
+        for i, token in enumerate(tokens, 1):
+            await pool.login(token, label=str(i), guild_id=self.config.BOT_GUILD_ID)
+
+    @property
+    def http(self) -> HTTPClient:
+        """
+        The HTTP client to make emoji requests with - the one for whichever pooled
+        token is running the current job, or else the bot's own.
+        """
+
+        return current_http.get() or self.client.http
+
     async def wait_until_ready(self):
         await self.client.wait_until_ready()
         logger.info("The bot is ready!")
@@ -226,38 +453,69 @@ class DiscordBot:
 
         task = asyncio.create_task(self.start())
 
-        async def raise_task_errors(aw: Awaitable):
-            await asyncio.wait([aw, task], return_when=asyncio.FIRST_COMPLETED)
+        async def raise_task_errors(aw: Awaitable) -> Any:
+            future = asyncio.ensure_future(aw)
+            await asyncio.wait([future, task], return_when=asyncio.FIRST_COMPLETED)
+
+            if not future.done():
+                future.cancel()
 
             if task.done():
                 exc = task.exception()
                 if exc:
                     raise exc
 
-        try:
-            await raise_task_errors(self.wait_until_ready())
-            yield self
-        except Exception as exc:
-            await self.close()
-            await raise_task_errors(asyncio.sleep(self.CLOSE_TIMEOUT))
-            raise exc
-        else:
-            await self.close()
-            await raise_task_errors(asyncio.sleep(self.CLOSE_TIMEOUT))
+            if not future.cancelled():
+                return future.result()
+
+        with tracer.span("DiscordBot.connection"):
+            try:
+                with tracer.span("DiscordBot.wait_until_ready"):
+                    await raise_task_errors(self.wait_until_ready())
+                with tracer.span("DiscordBot.open_pool"):
+                    await raise_task_errors(self.open_pool())
+                yield self
+            except Exception as exc:
+                with tracer.span("DiscordBot.close"):
+                    await self.close()
+                    await raise_task_errors(asyncio.sleep(self.CLOSE_TIMEOUT))
+                raise exc
+            else:
+                with tracer.span("DiscordBot.close"):
+                    await self.close()
+                    await raise_task_errors(asyncio.sleep(self.CLOSE_TIMEOUT))
 
     async def get_all_custom_emojis(self):
-        return [
-            EmojiResource.from_payload(raw)
-            for raw in await self.client.http.get_all_custom_emojis(
+        if self.live is not None and self.live.ready:
+            logger.debug("Using live emoji state instead of listing emojis...")
+            return self.live.emojis
+
+        with tracer.span("GET /guilds/{guild_id}/emojis"):
+            payloads = await self.client.http.get_all_custom_emojis(
                 self.config.BOT_GUILD_ID
             )
-        ]
+        return [EmojiResource.from_payload(raw) for raw in payloads]
+
+    def get_emoji_limit(self) -> int:
+        guild = self.client.get_guild(self.config.BOT_GUILD_ID)
+        if guild is None:
+            raise ValueError(f"Bot is not in guild {self.config.BOT_GUILD_ID}!")
+        return guild.emoji_limit
 
-    async def get_custom_emoji_changeset(self):
-        local = load_emojis()
+    @traced("DiscordBot.get_custom_emoji_changeset")
+    async def get_custom_emoji_changeset(
+        self,
+        baseline: Optional[Baseline] = None,
+        scope: Optional[Set[EmojiName]] = None,
+    ):
+        local = load_emojis(max_pixels=self.config.EMOJI_MAX_PIXELS, names=scope)
         upstream = await self.get_all_custom_emojis()
 
-        return Changeset.diff(upstream, local)
+        return Changeset.diff(upstream, local, baseline=baseline, scope=scope)
+
+    async def download_custom_emoji(self, resource: EmojiResource) -> bytes:
+        with tracer.span("GET cdn/emojis/{emoji_id}", id=resource.id):
+            return await self.client.http.get_from_cdn(resource.url)
 
     async def create_custom_emoji(
         self,
@@ -266,18 +524,23 @@ class DiscordBot:
         roles: Optional[List[DiscordID]] = None,
         reason: Optional[str] = None,
     ):
-        return await self.client.http.create_custom_emoji(
-            self.config.BOT_GUILD_ID,
-            emoji.name,
-            image_base64(emoji.image(), format="png"),
-            roles=roles,
-            reason=reason,
-        )
+        image = emoji.image_data()
+        self.expect(emoji.name)
+        with tracer.span("POST /guilds/{guild_id}/emojis", emoji=emoji.name):
+            return await self.http.create_custom_emoji(
+                self.config.BOT_GUILD_ID,
+                emoji.name,
+                image,
+                roles=roles,
+                reason=reason,
+            )
 
     async def delete_custom_emoji(self, emoji_id: DiscordID):
-        return await self.client.http.delete_custom_emoji(
-            self.config.BOT_GUILD_ID, emoji_id
-        )
+        self.expect(emoji_id)
+        with tracer.span("DELETE /guilds/{guild_id}/emojis/{emoji_id}", id=emoji_id):
+            return await self.http.delete_custom_emoji(
+                self.config.BOT_GUILD_ID, emoji_id
+            )
 
     async def edit_custom_emoji(
         self,
@@ -287,9 +550,11 @@ class DiscordBot:
         roles: Optional[List[DiscordID]] = None,
         reason: Optional[str] = None,
     ):
-        return await self.client.http.edit_custom_emoji(
-            self.config.BOT_GUILD_ID, emoji_id, name, roles=roles, reason=reason
-        )
+        self.expect(emoji_id)
+        with tracer.span("PATCH /guilds/{guild_id}/emojis/{emoji_id}", id=emoji_id):
+            return await self.http.edit_custom_emoji(
+                self.config.BOT_GUILD_ID, emoji_id, name, roles=roles, reason=reason
+            )
 
     async def replace_custom_emoji(
         self,
@@ -310,20 +575,81 @@ class DiscordBot:
             await self.create_custom_emoji(emoji, roles=roles, reason=reason),
         )
 
+    async def run_concurrently(
+        self,
+        jobs: List[Callable[[], Awaitable[Any]]],
+        concurrency: Optional[int] = None,
+    ) -> List[Any]:
+        """
+        Run a batch of jobs with at most `concurrency` (by default,
+        `EMOJI_CONCURRENCY`) of them in flight at once. Discord's rate limits are
+        per route, so this mostly helps hide request latency rather than getting
+        around the limits. If a job fails, no more jobs are started and the ones
+        in flight are cancelled.
+        """
+
+        concurrency = concurrency or self.config.EMOJI_CONCURRENCY
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        failed = asyncio.Event()
+
+        async def run(job: Callable[[], Awaitable[Any]]) -> Any:
+            async with semaphore:
+                if failed.is_set():
+                    raise asyncio.CancelledError()
+                try:
+                    return await job()
+                except Exception:
+                    failed.set()
+                    raise
+
+        return await gather_or_cancel(run(job) for job in jobs)
+
+    async def run_emoji_jobs(
+        self, jobs: List[Callable[[], Awaitable[Any]]]
+    ) -> List[Any]:
+        """
+        Run a batch of emoji writes, spreading them across the token pool if
+        there is one.
+        """
+
+        if self.pool is not None:
+            return await self.pool.run(jobs)
+        return await self.run_concurrently(jobs)
+
+    @traced("DiscordBot.apply_custom_emoji_changeset")
     async def apply_custom_emoji_changeset(
         self, changeset: Changeset, update_action: UpdateAction = EDIT
     ):
-        for name, emoji in changeset.create:
+        async def create(name: str, emoji: Emoji):
             logger.info(f"Creating emoji {name}...")
             await self.create_custom_emoji(emoji, reason="Creating a fresh emoji!")
-        for name, resource in changeset.remove:
+
+        async def remove(name: str, resource: EmojiResource):
             logger.info(f"Removing emoji {name}...")
             await self.delete_custom_emoji(resource.id)
-        for name, resource, emoji in changeset.update:
-            if update_action == REPLACE:
-                logger.info(f"Individually replacing emoji {name}...")
-                await self.replace_custom_emoji(
-                    resource.id, emoji, reason="Issuing a blind replace!"
-                )
-            else:
+
+        async def replace(name: str, resource: EmojiResource, emoji: Emoji):
+            logger.info(f"Individually replacing emoji {name}...")
+            await self.replace_custom_emoji(
+                resource.id, emoji, reason="Issuing a blind replace!"
+            )
+
+        await self.run_emoji_jobs(
+            [functools.partial(create, name, emoji) for name, emoji in changeset.create]
+        )
+        await self.run_emoji_jobs(
+            [
+                functools.partial(remove, name, resource)
+                for name, resource in changeset.remove
+            ]
+        )
+        if update_action == REPLACE:
+            await self.run_emoji_jobs(
+                [
+                    functools.partial(replace, name, resource, emoji)
+                    for name, resource, emoji in changeset.update
+                ]
+            )
+        else:
+            for name, resource, emoji in changeset.update:
                 logger.info(f"I would edit emoji {name} if that were implemented...")
@@ -2,18 +2,21 @@ import base64
 from dataclasses import dataclass, field
 from functools import lru_cache
 from io import BytesIO
+import math
 import os
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import Dict
+from typing import Dict, Optional, Set, Tuple
 
 from PIL import Image
 
-from de.config import EMOJIS_DIR
+from de.config import DEFAULT_EMOJI_MAX_PIXELS, EMOJIS_DIR, PixelCount
+from de.trace import traced, tracer
 
 
 EmojiName = str
 EmojiFormat = str
+ImageData = str
 
 
 EMOJI_WIDTH = 128  # px
@@ -21,31 +24,107 @@ EMOJI_HEIGHT = 128  # px
 EMOJI_SIZE = (EMOJI_WIDTH, EMOJI_HEIGHT)
 
 
+class EmojiError(Exception):
+    pass
+
+
+class OversizedEmojiError(EmojiError):
+    pass
+
+
+def _decode(path: Path, size: Tuple[int, int]):
+    im = Image.open(str(path))
+    im.draft(im.mode, size)
+    im.load()
+    return im
+
+
+def open_image(path: Path, max_pixels: PixelCount = DEFAULT_EMOJI_MAX_PIXELS):
+    """
+    Open and decode a source image while keeping memory bounded. Images with
+    more than `max_pixels` pixels are rejected from their header alone, before
+    anything gets decompressed, and formats that can decode at a reduced scale
+    (JPEG, mostly) are only decoded at the smallest scale that still covers
+    the emoji size once the image is cropped to its contents.
+    """
+
+    try:
+        im = Image.open(str(path))
+    except Image.DecompressionBombError as exc:
+        raise OversizedEmojiError(f"{path} looks like a decompression bomb!") from exc
+
+    width, height = im.size
+    im.close()
+
+    if width * height > max_pixels:
+        raise OversizedEmojiError(
+            f"{path} is {width}x{height}, which is more than {max_pixels} pixels!"
+        )
+
+    im = _decode(path, EMOJI_SIZE)
+    scale = im.width / width
+    bbox = im.getbbox()
+
+    if scale == 1 or bbox is None:
+        return im
+
+    # The draft scale was picked for the whole frame, but the emoji gets cropped
+    # to its contents. If those contents are too small at this scale, decode
+    # again at the scale the crop actually needs.
+    left, upper, right, lower = (edge / scale for edge in bbox)
+    needed = min(1.0, EMOJI_WIDTH / (right - left), EMOJI_HEIGHT / (lower - upper))
+
+    if needed <= scale:
+        return im
+
+    im.close()
+    return _decode(path, (math.ceil(width * needed), math.ceil(height * needed)))
+
+
 @dataclass(eq=True, frozen=True)
 class Emoji:
     name: EmojiName = field(compare=True)
     path: Path
+    max_pixels: PixelCount = field(default=DEFAULT_EMOJI_MAX_PIXELS, compare=False)
 
     @classmethod
-    def from_listing(cls, lx: str):
+    def from_listing(cls, lx: str, max_pixels: PixelCount = DEFAULT_EMOJI_MAX_PIXELS):
         path = EMOJIS_DIR / lx
-        return cls(name=path.stem, path=path)
+        return cls(name=path.stem, path=path, max_pixels=max_pixels)
 
     @lru_cache()
     def image(self):
-        original = Image.open(str(self.path))
-        im = original.crop(original.getbbox())
-        im.thumbnail(size=EMOJI_SIZE)
-        return im
+        with tracer.span("Emoji.image", cpu=True, emoji=self.name):
+            original = open_image(self.path, max_pixels=self.max_pixels)
+            im = original.crop(original.getbbox())
+            im.thumbnail(size=EMOJI_SIZE)
+            return im
+
+    def image_data(self) -> ImageData:
+        return image_base64(self.image(), format="png")
 
 
 EmojiMapping = Dict[EmojiName, Emoji]
 
 
-def load_emojis() -> EmojiMapping:
+def same_pixels(a: Image, b: Image) -> bool:
+    if a.size != b.size:
+        return False
+    return a.convert("RGBA").tobytes() == b.convert("RGBA").tobytes()
+
+
+@traced("load_emojis", cpu=True)
+def load_emojis(
+    max_pixels: PixelCount = DEFAULT_EMOJI_MAX_PIXELS,
+    names: Optional[Set[EmojiName]] = None,
+) -> EmojiMapping:
     return {
         emoji.name: emoji
-        for emoji in (Emoji.from_listing(lx) for lx in os.listdir(EMOJIS_DIR))
+        for emoji in (
+            Emoji.from_listing(lx, max_pixels=max_pixels)
+            for lx in os.listdir(EMOJIS_DIR)
+        )
+        if names is None or emoji.name in names
     }
 
 
@@ -62,12 +141,17 @@ def image_size(image: Image, format: str = "png") -> SizeInBytes:
     return size
 
 
-ImageData = str
+@traced("image_bytes", cpu=True)
+def image_bytes(image: Image, format: str = "png") -> bytes:
+    f = BytesIO()
+    image.save(f, format=format)
+    return f.getvalue()
+
 
+def encode_image_data(data: bytes, format: str = "png") -> ImageData:
+    return f"data:image/{format};base64,{base64.b64encode(data).decode('ascii')}"
 
+
+@traced("image_base64", cpu=True)
 def image_base64(image: Image, format: str = "png") -> ImageData:
-    f = BytesIO()
-    image.save(f, format=format)
-    return (
-        f"data:image/{format};base64,{base64.b64encode(f.getbuffer()).decode('ascii')}"
-    )
+    return encode_image_data(image_bytes(image, format=format), format=format)
@@ -0,0 +1,209 @@
+from dataclasses import dataclass, field
+import heapq
+from typing import Dict, List, Optional
+
+from de.discord import Changeset, EDIT, EmojiResource, REPLACE, UpdateAction
+from de.emojis import Emoji
+
+Seconds = float
+Route = str
+
+CREATE_ROUTE: Route = "POST /guilds/{guild_id}/emojis"
+DELETE_ROUTE: Route = "DELETE /guilds/{guild_id}/emojis/{emoji_id}"
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    limit: int
+    per: Seconds
+
+
+# Discord doesn't publish its emoji rate limits, and they are scoped to the
+# guild rather than to the bot. These are what we've observed in practice and
+# are deliberately on the pessimistic side. We haven't measured whether extra
+# bot tokens get budgets of their own, so they're assumed to share these.
+RATE_LIMITS: Dict[Route, RateLimit] = {
+    CREATE_ROUTE: RateLimit(limit=50, per=3600.0),
+    DELETE_ROUTE: RateLimit(limit=50, per=3600.0),
+}
+
+REQUEST_LATENCY: Seconds = 0.5
+
+DEFAULT_EMOJI_LIMIT = 50
+
+
+class _Bucket:
+    def __init__(self, rate_limit: RateLimit):
+        self.rate_limit = rate_limit
+        self.remaining = rate_limit.limit
+        self.reset_at: Seconds = 0.0
+
+    def acquire(self, now: Seconds) -> Seconds:
+        """
+        Take a slot from the bucket, returning the time at which the request
+        may actually go out.
+        """
+
+        if now >= self.reset_at:
+            self.remaining = self.rate_limit.limit
+            self.reset_at = now + self.rate_limit.per
+        if not self.remaining:
+            now = self.reset_at
+            self.remaining = self.rate_limit.limit
+            self.reset_at = now + self.rate_limit.per
+        self.remaining -= 1
+        return now
+
+
+Job = List[Route]
+Phase = List[Job]
+
+
+def simulate(
+    phases: List[Phase],
+    *,
+    concurrency: int = 1,
+    tokens: int = 1,
+    latency: Seconds = REQUEST_LATENCY,
+    rate_limits: Dict[Route, RateLimit] = RATE_LIMITS,
+) -> Seconds:
+    """
+    Estimate how long it takes to run a series of phases, mirroring how
+    `DiscordBot.apply_custom_emoji_changeset` runs them: each phase starts once
+    the previous one has finished, jobs within a phase are picked up by whichever
+    of the `concurrency` workers per token frees up first, and the requests
+    within a job go out one after the other. All tokens draw on the same
+    buckets, so extra tokens only add workers.
+    """
+
+    buckets = {route: _Bucket(rate_limit) for route, rate_limit in rate_limits.items()}
+    now: Seconds = 0.0
+
+    for phase in phases:
+        workers = [now] * max(concurrency, 1) * max(tokens, 1)
+        for job in phase:
+            t = heapq.heappop(workers)
+            for route in job:
+                if route in buckets:
+                    t = buckets[route].acquire(t)
+                t += latency
+            heapq.heappush(workers, t)
+        now = max(workers)
+
+    return now
+
+
+@dataclass
+class Estimate:
+    calls: Dict[Route, int] = field(default_factory=dict)
+    upload_bytes: int = 0
+    duration: Seconds = 0.0
+    emoji_limit: int = DEFAULT_EMOJI_LIMIT
+    tokens: int = 1
+    slots_used: int = 0
+    peak_slots: int = 0
+    overflow_at: Optional[str] = None
+
+    @property
+    def exceeds_emoji_limit(self) -> bool:
+        return self.overflow_at is not None
+
+    def report(self) -> str:
+        lines = ["Estimated cost of applying this changeset:"]
+        if self.calls:
+            for route, count in sorted(self.calls.items()):
+                lines.append(f"  {count:>5} x {route}")
+        else:
+            lines.append("  no API calls")
+        lines.append(f"  upload size: {self.upload_bytes / 1024:.1f} KiB (encoded)")
+        lines.append(f"  wall-clock time: ~{_fmt_duration(self.duration)}")
+        if self.tokens > 1:
+            lines.append(
+                f"    (assumes the {self.tokens} bot tokens share the guild's "
+                "rate limits; it's faster if they don't)"
+            )
+        lines.append(
+            f"  emoji slots: {self.slots_used} in use, "
+            f"peaking at {self.peak_slots} of {self.emoji_limit}"
+        )
+        if self.overflow_at is not None:
+            lines.append(
+                f"  WARNING: the emoji limit would be exceeded at {self.overflow_at}!"
+            )
+        return "\n".join(lines)
+
+
+def _fmt_duration(seconds: Seconds) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def _is_static_slot(resource: EmojiResource) -> bool:
+    return not resource.animated
+
+
+def estimate_changeset(
+    changeset: Changeset,
+    update_action: UpdateAction = EDIT,
+    *,
+    emoji_limit: int = DEFAULT_EMOJI_LIMIT,
+    concurrency: int = 1,
+    tokens: int = 1,
+) -> Estimate:
+    """
+    Work out what applying a changeset will cost: the API calls per route, the
+    bytes uploaded, how long it should take under the emoji rate limits and
+    whether the guild's (static) emoji slots overflow partway through.
+    """
+
+    estimate = Estimate(emoji_limit=emoji_limit, tokens=tokens)
+
+    def call(route: Route):
+        estimate.calls[route] = estimate.calls.get(route, 0) + 1
+
+    def upload(emoji: Emoji):
+        estimate.upload_bytes += len(emoji.image_data())
+
+    slots = len([up for up in changeset.upstream if _is_static_slot(up)])
+    estimate.slots_used = estimate.peak_slots = slots
+
+    def take_slot(name: str):
+        nonlocal slots
+        slots += 1
+        estimate.peak_slots = max(estimate.peak_slots, slots)
+        if slots > emoji_limit and estimate.overflow_at is None:
+            estimate.overflow_at = name
+
+    def free_slot(resource: EmojiResource):
+        nonlocal slots
+        if _is_static_slot(resource):
+            slots -= 1
+
+    phases: List[Phase] = [[], [], []]
+
+    for name, emoji in changeset.create:
+        call(CREATE_ROUTE)
+        upload(emoji)
+        take_slot(f"create {name}")
+        phases[0].append([CREATE_ROUTE])
+    for name, resource in changeset.remove:
+        call(DELETE_ROUTE)
+        free_slot(resource)
+        phases[1].append([DELETE_ROUTE])
+    if update_action == REPLACE:
+        for name, resource, emoji in changeset.update:
+            call(DELETE_ROUTE)
+            call(CREATE_ROUTE)
+            upload(emoji)
+            free_slot(resource)
+            take_slot(f"replace {name}")
+            phases[2].append([DELETE_ROUTE, CREATE_ROUTE])
+
+    estimate.duration = simulate(phases, concurrency=concurrency, tokens=tokens)
+
+    return estimate
@@ -0,0 +1,58 @@
+from pathlib import Path
+import subprocess
+from typing import List, Set
+
+from de.config import EMOJIS_DIR, PROJECT_ROOT
+from de.emojis import EmojiName
+from de.logger import logger
+
+GitRev = str
+
+
+class GitError(Exception):
+    pass
+
+
+def _git(args: List[str], cwd: Path = PROJECT_ROOT) -> str:
+    try:
+        result = subprocess.run(
+            ["git"] + args,
+            check=True,
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as exc:
+        stderr = getattr(exc, "stderr", None) or str(exc)
+        raise GitError(f"`git {' '.join(args)}` failed: {stderr.strip()}") from exc
+    return result.stdout
+
+
+def changed_emoji_names(
+    since: GitRev,
+    until: GitRev = "HEAD",
+    *,
+    root: Path = PROJECT_ROOT,
+    emojis_dir: Path = EMOJIS_DIR,
+) -> Set[EmojiName]:
+    """
+    Get the names of the emojis whose files were added, modified, renamed or
+    deleted between two revisions. Renames are reported as a delete and an add,
+    so both the old and the new name are included.
+    """
+
+    output = _git(
+        ["diff", "--name-status", "--no-renames", "-z", since, until, "--"]
+        + [str(emojis_dir.relative_to(root))],
+        cwd=root,
+    )
+
+    fields = output.split("\0")
+    names: Set[EmojiName] = set()
+
+    for status, path in zip(fields[::2], fields[1::2]):
+        name = Path(path).stem
+        logger.debug(f"{status} {path}")
+        names.add(name)
+
+    return names
@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+import functools
+from io import BytesIO
+import os
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from zipfile import ZIP_STORED, ZipFile
+
+from PIL import Image
+
+from de.discord import DiscordBot, DiscordID, EmojiResource
+from de.logger import logger
+
+ARCHIVE_SUFFIXES = {".zip"}
+
+DOWNLOAD_CONCURRENCY = 8
+
+
+def mirror_filename(resource: EmojiResource) -> str:
+    return f"{resource.name}.{resource.id}.{resource.extension}"
+
+
+def _mirror_id(filename: str) -> Optional[DiscordID]:
+    parts = filename.rsplit(".", 2)
+    if len(parts) != 3 or not parts[1].isdigit():
+        return None
+    return parts[1]
+
+
+class Mirror:
+    """
+    A local copy of the upstream emoji images, kept either in a directory or in
+    a zip archive. Files are named `{name}.{id}.{extension}` and are looked up
+    by emoji ID, so a renamed emoji doesn't need downloading again.
+    """
+
+    def __init__(self, path: Union[Path, str], writable: bool = False):
+        self.path = Path(path)
+        self.writable = writable
+        self.is_archive = self.path.suffix in ARCHIVE_SUFFIXES
+        self._archive: Optional[ZipFile] = None
+
+        if self.is_archive:
+            if writable:
+                self._archive = ZipFile(self.path, "a", compression=ZIP_STORED)
+            else:
+                self._archive = ZipFile(self.path, "r")
+            filenames = self._archive.namelist()
+        else:
+            if writable:
+                self.path.mkdir(parents=True, exist_ok=True)
+            filenames = os.listdir(self.path)
+
+        self._filenames: Dict[DiscordID, str] = dict()
+        for filename in filenames:
+            id_ = _mirror_id(filename)
+            if id_ is not None:
+                self._filenames[id_] = filename
+
+    def __contains__(self, resource: EmojiResource) -> bool:
+        return resource.id in self._filenames
+
+    def __len__(self) -> int:
+        return len(self._filenames)
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def read(self, resource: EmojiResource) -> Optional[bytes]:
+        if resource not in self:
+            return None
+        filename = self._filenames[resource.id]
+        if self._archive is not None:
+            return self._archive.read(filename)
+        return (self.path / filename).read_bytes()
+
+    def image(self, resource: EmojiResource) -> Optional[Image]:
+        data = self.read(resource)
+        if data is None:
+            return None
+        return Image.open(BytesIO(data))
+
+    def write(self, resource: EmojiResource, data: bytes):
+        if not self.writable:
+            raise RuntimeError(f"Mirror at {self.path} is read-only!")
+
+        filename = mirror_filename(resource)
+
+        if self._archive is not None:
+            self._archive.writestr(filename, data)
+        else:
+            # Write to a temporary file first so that an interrupted export never
+            # leaves a truncated image behind for the next run to skip over.
+            with NamedTemporaryFile(dir=self.path, delete=False) as f:
+                f.write(data)
+            os.replace(f.name, self.path / filename)
+
+        self._filenames[resource.id] = filename
+
+
+@contextmanager
+def open_mirror(path: Union[Path, str], writable: bool = False) -> Iterator[Mirror]:
+    mirror = Mirror(path, writable=writable)
+    try:
+        yield mirror
+    finally:
+        mirror.close()
+
+
+async def export_custom_emojis(
+    bot: DiscordBot, mirror: Mirror, concurrency: int = DOWNLOAD_CONCURRENCY
+) -> Tuple[int, int]:
+    """
+    Download every upstream emoji that isn't already in the mirror, returning
+    how many were downloaded and how many were skipped.
+    """
+
+    upstream = await bot.get_all_custom_emojis()
+    missing: List[EmojiResource] = [r for r in upstream if r not in mirror]
+
+    logger.info(
+        f"Downloading {len(missing)} emojis "
+        f"({len(upstream) - len(missing)} already mirrored)..."
+    )
+
+    async def download(resource: EmojiResource):
+        logger.debug(f"Downloading emoji {resource.name}...")
+        mirror.write(resource, await bot.download_custom_emoji(resource))
+
+    await bot.run_concurrently(
+        [functools.partial(download, r) for r in missing], concurrency=concurrency
+    )
+
+    return len(missing), len(upstream) - len(missing)
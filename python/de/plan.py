@@ -0,0 +1,239 @@
+from dataclasses import asdict, dataclass, field
+from io import BytesIO
+import json
+from pathlib import Path
+import struct
+from typing import Any, Dict, List, Optional, Tuple, Union
+import zlib
+
+from PIL import Image
+
+from de.config import DiscordGuildID, EMOJIS_DIR
+from de.discord import Changeset, EDIT, EmojiResource, REPLACE, UpdateAction
+from de.emojis import Emoji, encode_image_data, image_bytes, ImageData
+from de.logger import logger
+from de.trace import traced
+
+# A plan file is a fixed header, followed by zlib-compressed JSON describing
+# the changeset and the upstream state it was computed against, followed by the
+# PNG payloads for every emoji that needs uploading. The JSON refers to the
+# payloads by their offset and length within the payload section.
+MAGIC = b"DEPLAN"
+VERSION = 1
+HEADER = struct.Struct(">6sBI")
+
+Blob = Tuple[int, int]
+
+
+class PlanError(Exception):
+    pass
+
+
+class PlanFormatError(PlanError):
+    pass
+
+
+class PlanDriftError(PlanError):
+    pass
+
+
+@dataclass(eq=True, frozen=True)
+class PlannedEmoji(Emoji):
+    """
+    An emoji whose upload payload was already rendered when the plan was made,
+    so that applying the plan doesn't need to touch the source image at all.
+    """
+
+    png: Optional[bytes] = field(default=None, compare=False, repr=False)
+
+    def image(self):
+        if self.png is None:
+            raise PlanError(f"Plan has no image for emoji {self.name}!")
+        return Image.open(BytesIO(self.png))
+
+    def image_data(self) -> ImageData:
+        if self.png is None:
+            raise PlanError(f"Plan has no image for emoji {self.name}!")
+        return encode_image_data(self.png, format="png")
+
+
+def _resource_key(resource: EmojiResource) -> Tuple[Any, ...]:
+    return (
+        resource.id,
+        resource.name,
+        tuple(sorted(resource.roles)),
+        resource.require_colons,
+        resource.managed,
+        resource.animated,
+    )
+
+
+@dataclass
+class Plan:
+    guild_id: DiscordGuildID
+    update_action: UpdateAction
+    changeset: Changeset
+
+    def check_drift(self, guild_id: DiscordGuildID, upstream: List[EmojiResource]):
+        """
+        Refuse to go any further if the guild no longer looks like it did when
+        the plan was made.
+        """
+
+        if guild_id != self.guild_id:
+            raise PlanDriftError(
+                f"Plan was made for guild {self.guild_id}, not guild {guild_id}!"
+            )
+
+        expected = {_resource_key(r) for r in self.changeset.upstream}
+        actual = {_resource_key(r) for r in upstream}
+
+        if expected != actual:
+            drifted = sorted({key[1] for key in expected ^ actual})
+            raise PlanDriftError(
+                f"Upstream emojis have changed since the plan was made: "
+                f"{', '.join(drifted)}!"
+            )
+
+
+class _PayloadWriter:
+    def __init__(self):
+        self.buffer = BytesIO()
+
+    def add(self, emoji: Emoji) -> Blob:
+        data = image_bytes(emoji.image(), format="png")
+        offset = self.buffer.tell()
+        self.buffer.write(data)
+        return (offset, len(data))
+
+
+def _emoji_entry(emoji: Emoji, payloads: Optional[_PayloadWriter]) -> Dict[str, Any]:
+    entry: Dict[str, Any] = dict(name=emoji.name, path=emoji.path.name)
+    if payloads is not None:
+        entry["blob"] = payloads.add(emoji)
+    return entry
+
+
+@traced("write_plan", cpu=True)
+def write_plan(path: Union[Path, str], plan: Plan):
+    changeset = plan.changeset
+    payloads = _PayloadWriter()
+    replacing = plan.update_action == REPLACE
+
+    metadata = dict(
+        guild_id=plan.guild_id,
+        update_action=str(plan.update_action),
+        upstream=[asdict(resource) for resource in changeset.upstream],
+        create=[
+            dict(key=key, emoji=_emoji_entry(emoji, payloads))
+            for key, emoji in changeset.create
+        ],
+        remove=[dict(key=key, id=resource.id) for key, resource in changeset.remove],
+        update=[
+            dict(
+                key=key,
+                id=resource.id,
+                emoji=_emoji_entry(emoji, payloads if replacing else None),
+            )
+            for key, resource, emoji in changeset.update
+        ],
+        unchanged=[
+            dict(key=key, id=resource.id, emoji=_emoji_entry(emoji, None))
+            for key, resource, emoji in changeset.unchanged
+        ],
+    )
+
+    compressed = zlib.compress(json.dumps(metadata).encode("utf-8"), 9)
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(compressed)))
+        f.write(compressed)
+        f.write(payloads.buffer.getbuffer())
+
+    logger.info(
+        f"Wrote plan to {path} with {len(compressed)} bytes of metadata and "
+        f"{payloads.buffer.tell()} bytes of images."
+    )
+
+
+def _load_update_action(slug: str) -> UpdateAction:
+    for action in [EDIT, REPLACE]:
+        if slug == str(action):
+            return action
+    raise PlanFormatError(f"Unknown update action {slug!r}!")
+
+
+@traced("read_plan")
+def read_plan(path: Union[Path, str]) -> Plan:
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    if len(raw) < HEADER.size:
+        raise PlanFormatError(f"{path} is too short to be a plan file!")
+
+    magic, version, metadata_size = HEADER.unpack_from(raw)
+
+    if magic != MAGIC:
+        raise PlanFormatError(f"{path} is not a plan file!")
+    if version != VERSION:
+        raise PlanFormatError(f"Unsupported plan file version {version}!")
+
+    payload_start = HEADER.size + metadata_size
+
+    try:
+        metadata = json.loads(zlib.decompress(raw[HEADER.size : payload_start]))
+    except (zlib.error, ValueError) as exc:
+        raise PlanFormatError(f"{path} has corrupt metadata!") from exc
+
+    payloads = memoryview(raw)[payload_start:]
+
+    def load_emoji(entry: Dict[str, Any]) -> PlannedEmoji:
+        png: Optional[bytes] = None
+        if "blob" in entry:
+            offset, length = entry["blob"]
+            if offset + length > len(payloads):
+                raise PlanFormatError(f"{path} is truncated!")
+            png = bytes(payloads[offset : offset + length])
+        return PlannedEmoji(
+            name=entry["name"], path=EMOJIS_DIR / entry["path"], png=png
+        )
+
+    def lookup(id_: str) -> EmojiResource:
+        if id_ not in upstream_lookup:
+            raise PlanFormatError(f"Plan refers to unknown upstream emoji {id_}!")
+        return upstream_lookup[id_]
+
+    # The metadata decoded fine but might still not have the shape we expect,
+    # e.g. if it was written by hand or by a buggy version of this code.
+    try:
+        upstream = [EmojiResource.from_payload(up) for up in metadata["upstream"]]
+        upstream_lookup = {resource.id: resource for resource in upstream}
+
+        changeset = Changeset(
+            update=[
+                (entry["key"], lookup(entry["id"]), load_emoji(entry["emoji"]))
+                for entry in metadata["update"]
+            ],
+            remove=[
+                (entry["key"], lookup(entry["id"])) for entry in metadata["remove"]
+            ],
+            create=[
+                (entry["key"], load_emoji(entry["emoji"]))
+                for entry in metadata["create"]
+            ],
+            upstream=upstream,
+            unchanged=[
+                (entry["key"], lookup(entry["id"]), load_emoji(entry["emoji"]))
+                for entry in metadata.get("unchanged", [])
+            ],
+        )
+
+        plan = Plan(
+            guild_id=metadata["guild_id"],
+            update_action=_load_update_action(metadata["update_action"]),
+            changeset=changeset,
+        )
+    except (KeyError, TypeError, ValueError) as exc:
+        raise PlanFormatError(f"{path} has malformed metadata: {exc!r}") from exc
+
+    return plan
@@ -0,0 +1,188 @@
+import asyncio
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+import discord
+from discord.http import HTTPClient
+
+from de.logger import logger
+from de.tasks import gather_or_cancel
+from de.trace import tracer
+
+Seconds = float
+
+Job = Callable[[], Awaitable[Any]]
+
+# How long a request can take before we assume its token is waiting out a rate
+# limit. Emoji requests normally come back in well under a second.
+THROTTLE_THRESHOLD: Seconds = 2.0
+
+current_http: ContextVar[Optional[HTTPClient]] = ContextVar(
+    "current_http", default=None
+)
+
+
+# The most guilds a single call to list a bot's guilds returns.
+GUILDS_PAGE_SIZE = 200
+
+
+class TokenPoolError(Exception):
+    pass
+
+
+async def check_token(http: HTTPClient, guild_id: int, label: str):
+    """
+    Make sure a token's bot is in the guild and allowed to manage its emojis,
+    so that a bad token fails up front rather than as 403s halfway through an
+    apply.
+    """
+
+    with tracer.span("GET /users/@me/guilds", token=label):
+        guilds = await http.get_guilds(GUILDS_PAGE_SIZE)
+    guild = next((g for g in guilds if int(g["id"]) == guild_id), None)
+
+    if guild is None:
+        raise TokenPoolError(f"Token {label} isn't authorized on guild {guild_id}!")
+
+    permissions = discord.Permissions(
+        int(guild.get("permissions_new", guild.get("permissions", 0)))
+    )
+
+    if not (permissions.administrator or permissions.manage_emojis):
+        raise TokenPoolError(
+            f"Token {label} isn't allowed to manage emojis on guild {guild_id}!"
+        )
+
+
+@dataclass
+class TokenState:
+    label: str
+    http: HTTPClient
+    owned: bool = False
+    in_flight: int = 0
+    completed: int = 0
+    throttled: int = 0
+    waiting: int = 0
+    available: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def __post_init__(self):
+        self.available.set()
+
+    def start_waiting(self):
+        self.waiting += 1
+        if self.waiting == 1:
+            self.throttled += 1
+            logger.info(f"Token {self.label} is rate limited, moving work elsewhere...")
+            self.available.clear()
+
+    def stop_waiting(self):
+        self.waiting -= 1
+        if not self.waiting:
+            self.available.set()
+
+
+class TokenPool:
+    """
+    A pool of bot tokens that spreads emoji requests across their separate rate
+    limit budgets. Each token has `concurrency` workers pulling jobs off a
+    shared queue. When a token's request runs past `THROTTLE_THRESHOLD`, that
+    token is assumed to be rate limited and its workers stop taking new jobs
+    until it comes back, so the remaining work flows to the other tokens.
+
+    While a job runs, `current_http` is set to the HTTP client of the token
+    running it.
+    """
+
+    def __init__(self, concurrency: int = 1):
+        self.concurrency = concurrency
+        self.tokens: List[TokenState] = []
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def add(self, http: HTTPClient, label: str, owned: bool = False):
+        self.tokens.append(TokenState(label=label, http=http, owned=owned))
+
+    async def login(self, token: str, label: str, guild_id: int):
+        http = HTTPClient()
+        self.add(http, label, owned=True)
+        with tracer.span("GET /users/@me", token=label):
+            await http.static_login(token, bot=True)
+        await check_token(http, guild_id, label)
+
+    async def close(self):
+        for state in self.tokens:
+            if state.owned:
+                await state.http.close()
+
+    async def _run_job(self, state: TokenState, job: Job) -> Any:
+        current_http.set(state.http)
+        task = asyncio.ensure_future(job())
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), THROTTLE_THRESHOLD)
+        except asyncio.TimeoutError:
+            state.start_waiting()
+            try:
+                return await task
+            finally:
+                state.stop_waiting()
+        finally:
+            # The shield keeps the job running when we give up on it, so make
+            # sure it doesn't outlive a cancelled worker.
+            if not task.done():
+                task.cancel()
+
+    async def run(self, jobs: List[Job]) -> List[Any]:
+        if not self.tokens:
+            raise RuntimeError("Can't run jobs with an empty token pool!")
+
+        queue: "asyncio.Queue[Tuple[int, Job]]" = asyncio.Queue()
+        for i, job in enumerate(jobs):
+            queue.put_nowait((i, job))
+
+        results: List[Any] = [None] * len(jobs)
+        failed = asyncio.Event()
+
+        async def worker(state: TokenState):
+            while True:
+                await state.available.wait()
+                if failed.is_set():
+                    return
+                try:
+                    i, job = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                state.in_flight += 1
+                try:
+                    results[i] = await self._run_job(state, job)
+                except Exception:
+                    failed.set()
+                    while not queue.empty():
+                        queue.get_nowait()
+                    raise
+                finally:
+                    state.in_flight -= 1
+                    state.completed += 1
+
+        start = time.monotonic()
+
+        await gather_or_cancel(
+            worker(state)
+            for state in self.tokens
+            for _ in range(max(self.concurrency, 1))
+        )
+
+        logger.info(
+            f"Ran {len(jobs)} jobs across {len(self.tokens)} tokens "
+            f"in {time.monotonic() - start:.1f}s"
+        )
+        for state in self.tokens:
+            logger.debug(
+                f"Token {state.label}: {state.completed} jobs, "
+                f"rate limited {state.throttled} times"
+            )
+
+        return results
@@ -0,0 +1,30 @@
+import asyncio
+from typing import Any, Awaitable, Iterable, List
+
+
+async def gather_or_cancel(aws: Iterable[Awaitable[Any]]) -> List[Any]:
+    """
+    Like `asyncio.gather`, except that as soon as one of the awaitables fails,
+    everything still running is cancelled before the error is raised. Plain
+    `gather` leaves the rest running in the background, which for emoji writes
+    means requests keep firing after we've already given up.
+    """
+
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+
+    if not tasks:
+        return []
+
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()  # type: ignore
+
+    return [task.result() for task in tasks]
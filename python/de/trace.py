@@ -0,0 +1,165 @@
+import asyncio
+from contextlib import contextmanager
+import cProfile
+import functools
+import inspect
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar, Union
+
+from de.logger import logger
+
+TraceEvent = Dict[str, Any]
+Microseconds = int
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def _now() -> Microseconds:
+    return time.perf_counter_ns() // 1000
+
+
+class Tracer:
+    """
+    Collects nested timing spans and writes them out in the Chrome trace event
+    format, which can be loaded into chrome://tracing or https://ui.perfetto.dev.
+
+    Spans are recorded per asyncio task (or per thread outside of an event loop),
+    so concurrent requests show up as separate tracks instead of as overlapping
+    garbage. Spans marked as `cpu` additionally run under cProfile when profiling
+    is turned on.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events: List[TraceEvent] = []
+        self.profiler: Optional[cProfile.Profile] = None
+        self._profile_depth = 0
+        self._tids: Dict[int, int] = dict()
+
+    def start(self, profile: bool = False):
+        self.enabled = True
+        self.events = []
+        self._tids = dict()
+        self.profiler = cProfile.Profile() if profile else None
+        self._profile_depth = 0
+
+    def stop(self):
+        self.enabled = False
+
+    def _tid(self) -> int:
+        try:
+            key = id(asyncio.current_task())
+        except RuntimeError:
+            key = threading.get_ident()
+        return self._tids.setdefault(key, len(self._tids) + 1)
+
+    @contextmanager
+    def span(self, name: str, *, cpu: bool = False, **args: Any) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        profiler = self.profiler if cpu else None
+        if profiler is not None:
+            if not self._profile_depth:
+                profiler.enable()
+            self._profile_depth += 1
+
+        tid = self._tid()
+        start = _now()
+        try:
+            yield
+        finally:
+            end = _now()
+            if profiler is not None:
+                self._profile_depth -= 1
+                if not self._profile_depth:
+                    profiler.disable()
+            self.events.append(
+                dict(
+                    name=name,
+                    cat="cpu" if cpu else "io",
+                    ph="X",
+                    ts=start,
+                    dur=end - start,
+                    pid=os.getpid(),
+                    tid=tid,
+                    args={key: str(value) for key, value in args.items()},
+                )
+            )
+
+    def trace_events(self) -> Dict[str, Any]:
+        return dict(
+            traceEvents=sorted(self.events, key=lambda e: e["ts"]),
+            displayTimeUnit="ms",
+        )
+
+    def write(self, path: Union[Path, str]):
+        logger.info(f"Writing {len(self.events)} trace events to {path}...")
+        with open(path, "w") as f:
+            json.dump(self.trace_events(), f)
+
+    def dump_profile(self, path: Union[Path, str]):
+        if self.profiler is None:
+            raise RuntimeError("Profiling was not enabled for this trace!")
+        logger.info(f"Writing cProfile stats to {path}...")
+        self.profiler.dump_stats(str(path))
+
+
+tracer = Tracer()
+
+
+def traced(name: str, *, cpu: bool = False) -> Callable[[F], F]:
+    """
+    Decorate a function or coroutine function so that each call is recorded as a
+    span on the global tracer.
+    """
+
+    def decorator(fn: F) -> F:
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(name, cpu=cpu):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper  # type: ignore
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name, cpu=cpu):
+                return fn(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+@contextmanager
+def tracing(
+    trace_path: Optional[Union[Path, str]] = None,
+    profile_path: Optional[Union[Path, str]] = None,
+) -> Iterator[Tracer]:
+    """
+    Turn on the global tracer for the duration of the block, writing out the
+    trace and cProfile stats (if requested) when it exits - even on failure,
+    since a trace of a failed run is often the interesting one.
+    """
+
+    if trace_path is None and profile_path is None:
+        yield tracer
+        return
+
+    tracer.start(profile=profile_path is not None)
+    try:
+        yield tracer
+    finally:
+        tracer.stop()
+        if trace_path is not None:
+            tracer.write(trace_path)
+        if profile_path is not None:
+            tracer.dump_profile(profile_path)
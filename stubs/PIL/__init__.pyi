@@ -1,4 +1,17 @@
-from typing import IO, Optional
+from typing import IO, Optional, Tuple, Union
 
 class Image:
+    class DecompressionBombError(Exception): ...
+    mode: str
+    size: Tuple[int, int]
+    width: int
+    height: int
+    @staticmethod
+    def open(fp: Union[str, IO[bytes]]) -> Image: ...
+    def draft(self, mode: Optional[str], size: Tuple[int, int]) -> None: ...
+    def load(self) -> None: ...
+    def close(self) -> None: ...
+    def convert(self, mode: str) -> Image: ...
+    def tobytes(self) -> bytes: ...
+    def getbbox(self) -> Optional[Tuple[int, int, int, int]]: ...
     def save(self, fp: IO[bytes], format: Optional[str] = None, **params) -> None: ...
@@ -0,0 +1,38 @@
+import pytest
+
+from de.discord import EmojiResource
+from de.emojis import EmojiMapping, load_emojis
+
+
+@pytest.fixture(scope="session")
+def emojis() -> EmojiMapping:
+    return load_emojis()
+
+
+@pytest.fixture
+def make_payload():
+    def make(
+        name: str,
+        id_: str = "1",
+        roles=(),
+        managed: bool = False,
+        animated: bool = False,
+    ):
+        return dict(
+            id=id_,
+            name=name,
+            roles=list(roles),
+            require_colons=True,
+            managed=managed,
+            animated=animated,
+        )
+
+    return make
+
+
+@pytest.fixture
+def make_resource(make_payload):
+    def make(name: str, id_: str = "1", **kwargs) -> EmojiResource:
+        return EmojiResource.from_payload(make_payload(name, id_, **kwargs))
+
+    return make
@@ -0,0 +1,78 @@
+from contextlib import asynccontextmanager
+from typing import List
+
+from click.testing import CliRunner
+from PIL import Image
+import pytest
+
+from de import cli as cli_module
+from de.discord import Changeset, EmojiResource
+from de.emojis import Emoji
+from de.plan import Plan, write_plan
+
+
+class FakeBot:
+    upstream: List[EmojiResource] = []
+    local: List[Emoji] = []
+
+    def __init__(self, config, live=False):
+        self.config = config
+
+    @asynccontextmanager
+    async def connection(self):
+        yield self
+
+    async def get_all_custom_emojis(self):
+        return self.upstream
+
+    async def get_custom_emoji_changeset(self, baseline=None, scope=None):
+        for emoji in self.local:
+            emoji.image()
+        return Changeset(update=[], remove=[], create=[], upstream=self.upstream)
+
+
+@pytest.fixture
+def fake_bot(monkeypatch, make_resource):
+    monkeypatch.setattr(FakeBot, "upstream", [make_resource("spark", "1")])
+    monkeypatch.setattr(cli_module, "DiscordBot", FakeBot)
+    return FakeBot
+
+
+def test_apply_refuses_drifted_plan(tmp_path, monkeypatch, fake_bot):
+    monkeypatch.delenv("BOT_GUILD_ID", raising=False)
+
+    path = tmp_path / "plan.bin"
+    changeset = Changeset(update=[], remove=[], create=[], upstream=[])
+    guild_id = cli_module.Config.BOT_GUILD_ID
+    write_plan(
+        path,
+        Plan(guild_id=guild_id, update_action=cli_module.EDIT, changeset=changeset),
+    )
+
+    result = CliRunner().invoke(cli_module.cli, ["apply", str(path), "--yarly"])
+
+    assert result.exit_code != 0
+    assert "changed since the plan was made: spark" in result.output
+    assert "FLAGRANT" not in result.output, "Drift should be a clean error"
+
+
+def test_sync_reports_oversized_emojis(tmp_path, monkeypatch, fake_bot):
+    path = tmp_path / "huge.png"
+    Image.new("RGB", (200, 200)).save(path)
+    monkeypatch.setattr(fake_bot, "local", [Emoji("huge", path, max_pixels=100)])
+
+    result = CliRunner().invoke(cli_module.cli, ["sync-emojis", "--dry-run"])
+
+    assert result.exit_code != 0
+    assert "more than 100 pixels" in result.output
+    assert "FLAGRANT" not in result.output, "Oversized emojis should be a clean error"
+
+
+def test_sync_reports_bad_since_rev(fake_bot):
+    result = CliRunner().invoke(
+        cli_module.cli, ["sync-emojis", "--since", "nonexistent-rev"]
+    )
+
+    assert result.exit_code != 0
+    assert "git diff" in result.output
+    assert "FLAGRANT" not in result.output, "Git errors should be a clean error"
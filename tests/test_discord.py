@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+from de.config import Config
+from de.discord import Changeset, DiscordBot
+from de.emojis import load_emojis
+from de.trace import tracing
+
+
+def test_scoped_diff_leaves_other_emojis_alone(emojis, make_resource):
+    first, second, third = sorted(emojis)[:3]
+    upstream = [
+        make_resource(first, "1"),
+        make_resource("gone", "2"),
+        make_resource("old", "3"),
+    ]
+    scope = {first, second, "gone"}
+
+    changeset = Changeset.diff(
+        upstream, load_emojis(names=scope), scope=scope | {"missing"}
+    )
+
+    assert [key for key, _, _ in changeset.update] == [first]
+    assert [key for key, _ in changeset.remove] == ["gone"]
+    assert [key for key, _ in changeset.create] == [second]
+    assert changeset.upstream == upstream, "Upstream state should stay complete"
+
+
+@pytest.mark.parametrize("concurrency", [1, 2])
+def test_failing_job_stops_remaining_writes(concurrency):
+    started = []
+
+    def job(i: int):
+        async def run():
+            started.append(i)
+            await asyncio.sleep(0.01)
+            if i == 0:
+                raise RuntimeError("Nope!")
+            await asyncio.sleep(0.05)
+
+        return run
+
+    async def main():
+        bot = DiscordBot(Config(DISCORD_API_TOKEN=None, step_env=dict()))
+        with pytest.raises(RuntimeError):
+            await bot.run_concurrently(
+                [job(i) for i in range(5)], concurrency=concurrency
+            )
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+
+    assert started == list(range(concurrency)), "No writes after the failure"
+
+
+@pytest.mark.parametrize("concurrency", [0, -1])
+def test_run_concurrently_runs_jobs_one_at_a_time_without_concurrency(concurrency):
+    async def job():
+        return "done"
+
+    async def main():
+        config = Config(DISCORD_API_TOKEN=None, step_env=dict())
+        config.EMOJI_CONCURRENCY = concurrency
+        bot = DiscordBot(config)
+        return await asyncio.wait_for(bot.run_concurrently([job, job]), 1)
+
+    assert asyncio.run(main()) == ["done", "done"]
+
+
+def test_connection_stops_pool_login_when_the_gateway_dies(tmp_path):
+    class Bot(DiscordBot):
+        CLOSE_TIMEOUT = 0.01
+
+        async def start(self):
+            await asyncio.sleep(0.01)
+            raise ConnectionError("Gateway died!")
+
+        async def wait_until_ready(self):
+            pass
+
+        async def open_pool(self):
+            await asyncio.sleep(10)
+
+        async def close(self):
+            pass
+
+    async def main():
+        bot = Bot(Config(DISCORD_API_TOKEN=None, step_env=dict()))
+        async with bot.connection():
+            pass
+
+    trace_path = tmp_path / "trace.json"
+    with tracing(trace_path):
+        with pytest.raises(ConnectionError):
+            asyncio.run(asyncio.wait_for(main(), 1))
+
+    events = json.loads(trace_path.read_text())["traceEvents"]
+    assert "DiscordBot.open_pool" in [event["name"] for event in events]
@@ -1,12 +1,16 @@
+from PIL import Image, ImageDraw
 import pytest
 
 from de.emojis import (
+    Emoji,
     EMOJI_HEIGHT,
     EMOJI_MAX_SIZE,
     EMOJI_WIDTH,
     image_base64,
     image_size,
     load_emojis,
+    open_image,
+    OversizedEmojiError,
 )
 
 
@@ -30,3 +34,33 @@ def test_emojis_well_formed(name, emoji):
         image_size(image) <= EMOJI_MAX_SIZE
     ), f"Emoji {name} should be less than {EMOJI_MAX_SIZE} bytes in size!"
     assert "image/png;base64" in image_base64(image), "It should base64 encode!"
+
+
+def test_large_jpegs_decode_at_reduced_scale(tmp_path):
+    path = tmp_path / "huge.jpg"
+    Image.new("RGB", (4000, 3000), color="purple").save(path)
+
+    assert open_image(path).width <= 500, "It should decode at 1/8 scale"
+
+    image = Emoji(name="huge", path=path).image()
+    assert image.size == (EMOJI_WIDTH, 96)
+
+
+def test_padded_jpegs_decode_at_crop_scale(tmp_path):
+    path = tmp_path / "padded.jpg"
+    original = Image.new("RGB", (4000, 4000))
+    ImageDraw.Draw(original).rectangle([1700, 1700, 2299, 2299], fill="white")
+    original.save(path)
+
+    image = Emoji(name="padded", path=path).image()
+
+    assert max(image.size) == EMOJI_WIDTH, "The cropped content should fill the emoji"
+    assert min(image.size) >= EMOJI_WIDTH - 4
+
+
+def test_oversized_emojis_rejected(tmp_path):
+    path = tmp_path / "huge.png"
+    Image.new("RGB", (200, 200)).save(path)
+
+    with pytest.raises(OversizedEmojiError):
+        Emoji(name="huge", path=path, max_pixels=100 * 100).image()
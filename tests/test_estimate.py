@@ -0,0 +1,68 @@
+from de.discord import Changeset, EDIT, REPLACE
+from de.estimate import (
+    CREATE_ROUTE,
+    DELETE_ROUTE,
+    estimate_changeset,
+    RateLimit,
+    simulate,
+)
+
+
+def test_simulate_waits_out_rate_limits():
+    rate_limits = {CREATE_ROUTE: RateLimit(limit=2, per=60.0)}
+    phases = [[[CREATE_ROUTE]] * 5]
+
+    duration = simulate(phases, latency=1.0, rate_limits=rate_limits)
+
+    assert duration == 121.0, "Five calls at two a minute should take two resets"
+
+
+def test_simulate_shares_rate_limits_across_tokens():
+    rate_limits = {CREATE_ROUTE: RateLimit(limit=2, per=60.0)}
+    phases = [[[CREATE_ROUTE]] * 4]
+
+    duration = simulate(phases, tokens=2, latency=1.0, rate_limits=rate_limits)
+
+    assert duration == 61.0, "Tokens should draw on the guild's budget"
+    assert simulate(phases, tokens=2, latency=1.0, rate_limits={}) == 2.0
+
+
+def test_simulate_concurrency_hides_latency():
+    phases = [[["GET"]] * 4]
+
+    assert simulate(phases, concurrency=1, latency=1.0, rate_limits={}) == 4.0
+    assert simulate(phases, concurrency=4, latency=1.0, rate_limits={}) == 1.0
+
+
+def test_estimate_counts_calls_and_bytes(emojis, make_resource):
+    names = sorted(emojis)[:3]
+    upstream = [make_resource(names[2], id_="2"), make_resource("gone", id_="3")]
+    changeset = Changeset.diff(upstream, {name: emojis[name] for name in names})
+
+    edit = estimate_changeset(changeset, update_action=EDIT)
+    assert edit.calls == {CREATE_ROUTE: 2, DELETE_ROUTE: 1}
+    assert edit.upload_bytes > 0
+
+    replace = estimate_changeset(changeset, update_action=REPLACE)
+    assert replace.calls == {CREATE_ROUTE: 3, DELETE_ROUTE: 2}
+    assert replace.upload_bytes > edit.upload_bytes
+
+    pooled = estimate_changeset(changeset, tokens=2)
+    assert "share the guild's rate limits" in pooled.report()
+    assert "share" not in edit.report()
+
+
+def test_estimate_flags_emoji_limit_overflow(emojis, make_resource):
+    names = sorted(emojis)[:3]
+    upstream = [
+        make_resource("gone", id_="1"),
+        make_resource("party", id_="2", animated=True),
+    ]
+    changeset = Changeset.diff(upstream, {name: emojis[name] for name in names})
+
+    estimate = estimate_changeset(changeset, emoji_limit=3)
+
+    assert estimate.slots_used == 1, "Animated emojis use separate slots"
+    assert estimate.peak_slots == 4, "Creates happen before removes"
+    assert estimate.exceeds_emoji_limit
+    assert "WARNING" in estimate.report()
@@ -0,0 +1,40 @@
+import subprocess
+
+import pytest
+
+from de.git import changed_emoji_names, GitError
+
+
+def git(root, *args):
+    subprocess.run(["git", *args], cwd=root, check=True, capture_output=True)
+
+
+def test_changed_emoji_names(tmp_path):
+    emojis_dir = tmp_path / "emojis"
+    emojis_dir.mkdir()
+
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "config", "user.email", "test@example.com")
+    git(tmp_path, "config", "user.name", "Test")
+
+    for name in ["kept", "modified", "renamed", "deleted"]:
+        (emojis_dir / f"{name}.png").write_bytes(name.encode("utf-8"))
+    (tmp_path / "README.md").write_text("hi")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "before")
+
+    (emojis_dir / "added.png").write_bytes(b"added")
+    (emojis_dir / "modified.png").write_bytes(b"changed")
+    git(tmp_path, "mv", "emojis/renamed.png", "emojis/moved.png")
+    git(tmp_path, "rm", "-q", "emojis/deleted.png")
+    (tmp_path / "README.md").write_text("bye")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "after")
+
+    names = changed_emoji_names("HEAD~1", root=tmp_path, emojis_dir=emojis_dir)
+
+    assert names == {"added", "modified", "renamed", "moved", "deleted"}
+    assert changed_emoji_names("HEAD", root=tmp_path, emojis_dir=emojis_dir) == set()
+
+    with pytest.raises(GitError):
+        changed_emoji_names("nonexistent-rev", root=tmp_path, emojis_dir=emojis_dir)
@@ -0,0 +1,56 @@
+from de.discord import GUILD_CREATE, GUILD_EMOJIS_UPDATE, LiveEmojis
+
+
+GUILD_ID = 1234
+
+
+def event(t: str, emojis, **data):
+    return dict(op=0, t=t, d=dict(emojis=emojis, **data))
+
+
+def test_live_emojis_follow_gateway_events(make_payload):
+    live = LiveEmojis(GUILD_ID)
+    updates = []
+    live.listeners.append(updates.append)
+
+    assert not live.ready
+
+    live.handle(event(GUILD_CREATE, [make_payload("spark", "1")], id=str(GUILD_ID)))
+    assert [r.name for r in live.emojis] == ["spark"]
+
+    live.handle(event(GUILD_EMOJIS_UPDATE, [], guild_id=str(GUILD_ID + 1)))
+    assert [r.name for r in live.emojis] == ["spark"], "Other guilds are ignored"
+
+    live.expect("dask")
+    update = live.handle(
+        event(
+            GUILD_EMOJIS_UPDATE,
+            [make_payload("spark", "1", roles=["9"]), make_payload("dask", "2")],
+            guild_id=str(GUILD_ID),
+        )
+    )
+
+    assert updates == [update]
+    assert [r.name for r in update.added] == ["dask"]
+    assert [r.name for r in update.changed] == ["spark"]
+    assert update.out_of_band == ["spark"], "Only unexpected changes are flagged"
+    assert sorted(r.name for r in live.emojis) == ["dask", "spark"]
+
+
+def test_live_emojis_diff_guild_create_after_reconnect(make_payload):
+    live = LiveEmojis(GUILD_ID)
+    updates = []
+    live.listeners.append(updates.append)
+
+    live.handle(event(GUILD_CREATE, [make_payload("spark", "1")], id=str(GUILD_ID)))
+    assert updates == [], "The first GUILD_CREATE only seeds the mirror"
+
+    update = live.handle(
+        event(GUILD_CREATE, [make_payload("dask", "2")], id=str(GUILD_ID))
+    )
+
+    assert updates == [update]
+    assert [r.name for r in update.added] == ["dask"]
+    assert [r.name for r in update.removed] == ["spark"]
+    assert sorted(update.out_of_band) == ["dask", "spark"]
+    assert [r.name for r in live.emojis] == ["dask"]
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from de.config import Config
+from de.discord import Changeset, DiscordBot
+from de.emojis import image_bytes
+from de.mirror import export_custom_emojis, open_mirror
+
+
+@pytest.mark.parametrize("filename", ["mirror", "mirror.zip"])
+def test_mirror_is_resumable(tmp_path, filename, emojis, make_resource):
+    path = tmp_path / filename
+    name = sorted(emojis)[0]
+    up = make_resource(name, "42")
+    data = image_bytes(emojis[name].image())
+
+    with open_mirror(path, writable=True) as mirror:
+        assert up not in mirror
+        mirror.write(up, data)
+
+    with open_mirror(path) as mirror:
+        assert make_resource("renamed", "42") in mirror, "Lookups should go by ID"
+        assert make_resource(name, "43") not in mirror
+        assert mirror.read(up) == data
+
+
+def test_diff_against_baseline(tmp_path, emojis, make_resource):
+    first, second = sorted(emojis)[:2]
+    upstream = [make_resource(first, "1"), make_resource(second, "2")]
+
+    with open_mirror(tmp_path, writable=True) as mirror:
+        mirror.write(upstream[0], image_bytes(emojis[first].image()))
+        mirror.write(upstream[1], image_bytes(emojis[first].image()))
+
+        changeset = Changeset.diff(
+            upstream, {first: emojis[first], second: emojis[second]}, mirror.image
+        )
+
+    assert [key for key, _, _ in changeset.unchanged] == [first]
+    assert [key for key, _, _ in changeset.update] == [second]
+
+    report = changeset.report()
+    assert list(report[report.action == "unchanged"].name) == [first]
+
+
+def test_export_downloads_only_missing_emojis(tmp_path, make_resource):
+    upstream = [make_resource(f"emoji{i}", str(i)) for i in range(6)]
+    downloaded = []
+    in_flight = peak = 0
+
+    class Bot(DiscordBot):
+        async def get_all_custom_emojis(self):
+            return upstream
+
+        async def download_custom_emoji(self, resource):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            downloaded.append(resource.id)
+            return resource.id.encode("utf-8")
+
+    async def export(mirror):
+        bot = Bot(Config(DISCORD_API_TOKEN=None, step_env=dict()))
+        return await export_custom_emojis(bot, mirror, concurrency=2)
+
+    with open_mirror(tmp_path, writable=True) as mirror:
+        mirror.write(upstream[0], b"already mirrored")
+        counts = asyncio.run(export(mirror))
+
+        assert mirror.read(upstream[0]) == b"already mirrored"
+        assert mirror.read(upstream[5]) == b"5"
+
+    assert counts == (5, 1)
+    assert sorted(downloaded) == ["1", "2", "3", "4", "5"], "Only missing IDs"
+    assert peak == 2, "Downloads should respect the concurrency limit"
@@ -0,0 +1,111 @@
+import json
+import zlib
+
+import pytest
+
+from de.discord import Changeset, EDIT, REPLACE
+from de.plan import (
+    HEADER,
+    MAGIC,
+    Plan,
+    PlanDriftError,
+    PlanError,
+    PlanFormatError,
+    read_plan,
+    VERSION,
+    write_plan,
+)
+
+
+GUILD_ID = 1234
+
+
+@pytest.fixture
+def changeset(emojis, make_resource):
+    names = sorted(emojis)[:3]
+    upstream = [make_resource(names[2], "2"), make_resource("gone", "3")]
+    return Changeset.diff(upstream, {name: emojis[name] for name in names})
+
+
+def test_plan_round_trip(tmp_path, changeset):
+    path = tmp_path / "plan.bin"
+    write_plan(
+        path, Plan(guild_id=GUILD_ID, update_action=REPLACE, changeset=changeset)
+    )
+
+    plan = read_plan(path)
+
+    assert plan.guild_id == GUILD_ID
+    assert plan.update_action == REPLACE
+    assert plan.changeset.report().equals(changeset.report())
+
+    for name, emoji in changeset.create:
+        planned = dict(plan.changeset.create)[name]
+        assert planned.image_data() == emoji.image_data(), "Payloads should match"
+    for name, _, emoji in plan.changeset.update:
+        assert emoji.image_data().startswith("data:image/png;base64,")
+
+    plan.check_drift(GUILD_ID, changeset.upstream)
+
+
+def test_edit_plan_skips_update_payloads(tmp_path, changeset):
+    path = tmp_path / "plan.bin"
+    write_plan(path, Plan(guild_id=GUILD_ID, update_action=EDIT, changeset=changeset))
+
+    plan = read_plan(path)
+
+    for name, _, emoji in plan.changeset.update:
+        with pytest.raises(PlanError):
+            emoji.image_data()
+
+
+def test_plan_keeps_unchanged_emojis(tmp_path, emojis, make_resource):
+    name = sorted(emojis)[0]
+    changeset = Changeset.diff(
+        [make_resource(name, "1")],
+        {name: emojis[name]},
+        baseline=lambda resource: emojis[resource.name].image(),
+    )
+    path = tmp_path / "plan.bin"
+    write_plan(path, Plan(guild_id=GUILD_ID, update_action=EDIT, changeset=changeset))
+
+    plan = read_plan(path)
+
+    assert [key for key, _, _ in plan.changeset.unchanged] == [name]
+    assert plan.changeset.report().equals(changeset.report())
+
+
+def test_plan_refuses_drift(tmp_path, changeset):
+    path = tmp_path / "plan.bin"
+    write_plan(path, Plan(guild_id=GUILD_ID, update_action=EDIT, changeset=changeset))
+    plan = read_plan(path)
+
+    with pytest.raises(PlanDriftError, match="gone"):
+        plan.check_drift(GUILD_ID, changeset.upstream[:1])
+    with pytest.raises(PlanDriftError):
+        plan.check_drift(GUILD_ID + 1, changeset.upstream)
+
+
+def test_plan_rejects_garbage(tmp_path):
+    path = tmp_path / "plan.bin"
+    path.write_bytes(b"not a plan at all")
+
+    with pytest.raises(PlanFormatError):
+        read_plan(path)
+
+
+@pytest.mark.parametrize(
+    "metadata",
+    [
+        {"guild_id": 1},
+        {"guild_id": 1, "upstream": [{"name": "spark"}]},
+        {"guild_id": 1, "upstream": 5, "update": [], "remove": [], "create": []},
+    ],
+)
+def test_plan_rejects_malformed_metadata(tmp_path, metadata):
+    encoded = zlib.compress(json.dumps(metadata).encode())
+    path = tmp_path / "plan.bin"
+    path.write_bytes(HEADER.pack(MAGIC, VERSION, len(encoded)) + encoded)
+
+    with pytest.raises(PlanFormatError, match="malformed"):
+        read_plan(path)
@@ -0,0 +1,105 @@
+import asyncio
+
+import discord
+import pytest
+
+from de import pool as pool_module
+from de.pool import check_token, current_http, TokenPool, TokenPoolError
+
+
+GUILD_ID = 1234
+
+
+def test_pool_moves_work_away_from_throttled_tokens(monkeypatch):
+    monkeypatch.setattr(pool_module, "THROTTLE_THRESHOLD", 0.05)
+
+    ran_on = []
+
+    async def job():
+        http = current_http.get()
+        ran_on.append(http)
+        await asyncio.sleep(0.5 if http == "slow" else 0.01)
+        return http
+
+    async def main():
+        token_pool = TokenPool(concurrency=1)
+        token_pool.add("slow", label="0")  # type: ignore
+        token_pool.add("fast", label="1")  # type: ignore
+        results = await token_pool.run([job] * 10)
+        return token_pool, results
+
+    token_pool, results = asyncio.run(main())
+
+    assert sorted(results) == sorted(ran_on), "Each job should report its token"
+    assert ran_on.count("slow") == 1, "The throttled token should only get one job"
+    assert token_pool.tokens[0].throttled == 1
+    assert token_pool.tokens[1].completed == 9
+
+
+def test_pool_stops_on_first_failure():
+    started = []
+
+    def job(i: int):
+        async def run():
+            started.append(i)
+            await asyncio.sleep(0.01)
+            if i == 0:
+                raise RuntimeError("Nope!")
+            await asyncio.sleep(0.05)
+
+        return run
+
+    async def main():
+        token_pool = TokenPool(concurrency=1)
+        token_pool.add("a", label="0")  # type: ignore
+        token_pool.add("b", label="1")  # type: ignore
+        with pytest.raises(RuntimeError):
+            await token_pool.run([job(i) for i in range(6)])
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+
+    assert sorted(started) == [0, 1], "No jobs should start after a failure"
+
+
+class FakeHTTP:
+    def __init__(self, guilds):
+        self.guilds = guilds
+
+    async def get_guilds(self, limit):
+        return self.guilds
+
+
+@pytest.mark.parametrize(
+    "guilds,ok",
+    [
+        ([dict(id="1", permissions_new="0")], False),
+        ([dict(id=str(GUILD_ID), permissions_new="0")], False),
+        (
+            [
+                dict(
+                    id=str(GUILD_ID),
+                    permissions_new=str(discord.Permissions(manage_emojis=True).value),
+                )
+            ],
+            True,
+        ),
+        (
+            [
+                dict(
+                    id=str(GUILD_ID),
+                    permissions=discord.Permissions(administrator=True).value,
+                )
+            ],
+            True,
+        ),
+    ],
+)
+def test_check_token(guilds, ok):
+    check = check_token(FakeHTTP(guilds), GUILD_ID, "1")  # type: ignore
+
+    if ok:
+        asyncio.run(check)
+    else:
+        with pytest.raises(TokenPoolError):
+            asyncio.run(check)
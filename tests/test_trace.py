@@ -0,0 +1,41 @@
+import asyncio
+import json
+
+from de.emojis import image_base64, load_emojis
+from de.trace import traced, tracer, tracing
+
+
+def test_spans_disabled_by_default():
+    with tracer.span("nothing"):
+        pass
+    assert not tracer.enabled
+
+
+def test_nested_spans_written_as_chrome_trace(tmp_path):
+    trace_path = tmp_path / "trace.json"
+    profile_path = tmp_path / "trace.prof"
+
+    @traced("outer")
+    async def outer():
+        emoji = next(iter(load_emojis().values()))
+        image_base64(emoji.image())
+
+    with tracing(trace_path, profile_path):
+        asyncio.run(outer())
+
+    events = json.loads(trace_path.read_text())["traceEvents"]
+    names = [event["name"] for event in events]
+
+    assert names[0] == "outer", "The outermost span should start first"
+    for name in ["load_emojis", "image_base64"]:
+        assert name in names, f"Expected a {name} span"
+    assert all(event["ph"] == "X" for event in events)
+
+    outer_event = events[0]
+    for event in events[1:]:
+        assert event["ts"] >= outer_event["ts"]
+        assert (
+            event["ts"] + event["dur"] <= outer_event["ts"] + outer_event["dur"]
+        ), f"Span {event['name']} should nest inside the outer span"
+
+    assert profile_path.exists(), "It should dump cProfile stats"